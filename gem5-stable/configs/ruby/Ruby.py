@@ -39,7 +39,10 @@
 #
 # Authors: Brad Beckmann
 
-import math
+from __future__ import print_function
+
+import importlib
+import sys
 import m5
 from m5.objects import *
 from m5.defines import buildEnv
@@ -47,9 +50,6 @@ from m5.util import addToPath, fatal
 
 addToPath('../topologies')
 
-import inspect
-from textwrap import TextWrapper
-
 RubyMemoryControl = None
 
 _ruby_mem_aliases_all = [
@@ -57,7 +57,10 @@ _ruby_mem_aliases_all = [
     ("nvmain", "NVMMemoryControl"),
     ]
 
-_ruby_mem_classes = {}
+# The memory classes found in m5.objects are carried over when this
+# module is reloaded, so _populate_mem_classes can skip walking
+# m5.objects again when nothing there has changed.
+_ruby_mem_classes = globals().get('_ruby_mem_classes', {})
 _ruby_mem_aliases = {}
 
 def is_ruby_mem_class(cls):
@@ -71,45 +74,122 @@ def is_ruby_mem_class(cls):
     except TypeError:
         return False
 
-# Add all memory controllers in the object hierarchy.
-for name, cls in inspect.getmembers(m5.objects, is_ruby_mem_class):
-    _ruby_mem_classes[name] = cls
-
-for alias, target in _ruby_mem_aliases_all:
-    if isinstance(target, tuple):
-        # Some aliases contain a list of CPU model sorted in priority
-        # order. Use the first target that's available.
-        for t in target:
-            if t in _ruby_mem_classes:
-                _ruby_mem_aliases[alias] = t
-                break
-    elif target in _ruby_mem_classes:
-        # Normal alias
-        _ruby_mem_aliases[alias] = target
+# Copy of the m5.objects bindings and the code of is_ruby_mem_class that
+# _ruby_mem_classes was built from. Reloading this module creates a new
+# is_ruby_mem_class, so its code is compared rather than the function.
+_scanned_objects = globals().get('_scanned_objects')
+_scanned_code = globals().get('_scanned_code')
+
+# Names of all memory classes and aliases, rebuilt with the maps above
+# so that building a parser does not have to join them every time.
+_ruby_mem_names_cached = ()
+
+# Formatted output of print_ruby_mem_list, built on first use.
+_ruby_mem_list_cache = None
+
+def _objects_unchanged(objects):
+    """Check if objects binds the same names to the same objects as the
+    copy taken by the last scan."""
+
+    if _scanned_objects is None or len(objects) != len(_scanned_objects):
+        return False
+    for name, obj in objects.items():
+        if name not in _scanned_objects or _scanned_objects[name] is not obj:
+            return False
+    return True
+
+def _populate_mem_classes():
+    """Fill in the memory classes and aliases from m5.objects."""
+
+    global _scanned_objects, _scanned_code, _ruby_mem_names_cached, \
+        _ruby_mem_list_cache
+
+    # Add all memory controllers in the object hierarchy. Walk the module
+    # dictionary directly; inspect.getmembers would sort every name in
+    # m5.objects and look each of them up again. The walk is skipped if
+    # neither m5.objects nor is_ruby_mem_class changed since the last one.
+    objects = vars(m5.objects)
+    if _scanned_code != is_ruby_mem_class.__code__ or \
+       not _objects_unchanged(objects):
+        _ruby_mem_classes.clear()
+        for name, cls in objects.items():
+            if is_ruby_mem_class(cls):
+                _ruby_mem_classes[name] = cls
+        _scanned_objects = dict(objects)
+        _scanned_code = is_ruby_mem_class.__code__
+
+    # Normal aliases
+    _ruby_mem_aliases.clear()
+    _ruby_mem_aliases.update((alias, target)
+                             for alias, target in _ruby_mem_aliases_all
+                             if isinstance(target, str) and
+                             target in _ruby_mem_classes)
+
+    # Aliases may also contain a list of memory classes sorted in priority
+    # order. Use the first target that's available.
+    for alias, target in _ruby_mem_aliases_all:
+        if isinstance(target, tuple):
+            for t in target:
+                if t in _ruby_mem_classes:
+                    _ruby_mem_aliases[alias] = t
+                    break
+
+    _ruby_mem_names_cached = \
+        tuple(_ruby_mem_classes) + tuple(_ruby_mem_aliases)
+    _ruby_mem_list_cache = None
+
+_populate_mem_classes()
 
 def ruby_mem_names():
-    """Return a list of valid CPU names."""
-    return _ruby_mem_classes.keys() + _ruby_mem_aliases.keys()
+    """Return a tuple of valid memory controller names."""
+    return _ruby_mem_names_cached
 
-def print_ruby_mem_list():
-    """Print a list of available memory classes including their aliases."""
+# Cleaned up class documentation, indexed by class.
+_ruby_mem_docs = {}
+
+def _docstring(cls):
+    """Return the documentation of a class, caching the result."""
+
+    try:
+        return _ruby_mem_docs[cls]
+    except KeyError:
+        # Only needed for listing the memory classes, so keep it off the
+        # import path of this module.
+        import inspect
+        doc = _ruby_mem_docs[cls] = inspect.getdoc(cls)
+        return doc
 
-    print "Available memory classes:"
+def _format_ruby_mem_list():
+    """Format the list of memory classes and aliases as a string."""
+
+    from textwrap import TextWrapper
+
+    lines = ["Available memory classes:"]
     doc_wrapper = TextWrapper(initial_indent="\t\t", subsequent_indent="\t\t")
-    for name, cls in _ruby_mem_classes.items():
-        print "\t%s" % name
+    for name in sorted(_ruby_mem_classes):
+        lines.append("\t%s" % name)
 
         # Try to extract the class documentation from the class help
         # string.
-        doc = inspect.getdoc(cls)
+        doc = _docstring(_ruby_mem_classes[name])
         if doc:
-            for line in doc_wrapper.wrap(doc):
-                print line
+            lines.extend(doc_wrapper.wrap(doc))
 
     if _ruby_mem_aliases:
-        print "\nMemory aliases:"
-        for alias, target in _ruby_mem_aliases.items():
-            print "\t%s => %s" % (alias, target)
+        lines.append("\nMemory aliases:")
+        for alias in sorted(_ruby_mem_aliases):
+            lines.append("\t%s => %s" % (alias, _ruby_mem_aliases[alias]))
+
+    lines.append("")
+    return "\n".join(lines)
+
+def print_ruby_mem_list():
+    """Print a list of available memory classes including their aliases."""
+
+    global _ruby_mem_list_cache
+    if _ruby_mem_list_cache is None:
+        _ruby_mem_list_cache = _format_ruby_mem_list()
+    sys.stdout.write(_ruby_mem_list_cache)
 
 def get_ruby_mem_class(name):
     """Get a memory class from a user provided class name or alias."""
@@ -120,14 +200,68 @@ def get_ruby_mem_class(name):
         ruby_mem_class = _ruby_mem_classes[real_name]
         return ruby_mem_class
     except KeyError:
-        print "%s is not a valid memory controller." % (name,)
-        sys.exit(1)
+        raise ValueError("%s is not a valid memory controller." % (name,))
 
 def _listRubyMemTypes(option, opt, value, parser):
     print_ruby_mem_list()
     sys.exit(0)
 
+# Network, internal link, external link, router and network interface
+# classes for each --garnet-network choice. Networks whose classes are
+# not part of this build are left out of _network_classes.
+_network_class_names = [
+    ("fixed", ("GarnetNetwork_d", "GarnetIntLink_d", "GarnetExtLink_d",
+               "GarnetRouter_d", "GarnetNetworkInterface_d")),
+    ("flexible", ("GarnetNetwork", "GarnetIntLink", "GarnetExtLink",
+                  "GarnetRouter", "GarnetNetworkInterface")),
+    (None, ("SimpleNetwork", "SimpleIntLink", "SimpleExtLink", "Switch",
+            None)),
+    ]
+
+_network_classes = {}
+
+def _populate_network_classes():
+    """Resolve the network class names that exist in m5.objects."""
+
+    _network_classes.clear()
+    for garnet_network, names in _network_class_names:
+        try:
+            _network_classes[garnet_network] = \
+                tuple(getattr(m5.objects, n) if n else None for n in names)
+        except AttributeError:
+            pass
+
+_populate_network_classes()
+
+def cached_import(module_name):
+    """Import a module, reusing the copy in sys.modules if it is loaded."""
+
+    mod = sys.modules.get(module_name)
+    # Modules that are still being initialized (e.g., during a circular
+    # import) have to go through the regular import machinery.
+    spec = getattr(mod, '__spec__', None)
+    if mod is not None and not getattr(spec, '_initializing', False):
+        return mod
+    return importlib.import_module(module_name)
+
+# The protocol is fixed at build time. Its module is imported the first
+# time it is needed rather than here, since every protocol module imports
+# create_topology from this module.
+_protocol = buildEnv['PROTOCOL']
+_protocol_module = None
+
+def _get_protocol_module():
+    """Return the configuration module of the compiled-in protocol."""
+
+    global _protocol_module
+    if _protocol_module is None:
+        _protocol_module = cached_import(_protocol)
+    return _protocol_module
+
 def define_options(parser):
+    # Pick up memory controllers added to or replaced in m5.objects
+    _populate_mem_classes()
+
     # By default, ruby uses the simple timing cpu
     parser.set_defaults(cpu_type="timing")
 
@@ -157,7 +291,7 @@ def define_options(parser):
 
     # memory controller options
     parser.add_option("--ruby-mem-type", type="choice", default="nvmain",
-                      choices=ruby_mem_names(),
+                      choices=_ruby_mem_names_cached,
                       help = "type of memory to use with ruby")
     parser.add_option("--list-ruby-mem-types",
                       action="callback", callback=_listRubyMemTypes,
@@ -175,9 +309,20 @@ def define_options(parser):
 
     parser.add_option("--ruby_stats", type="string", default="ruby.stats")
 
-    protocol = buildEnv['PROTOCOL']
-    exec "import %s" % protocol
-    eval("%s.define_options(parser)" % protocol)
+    _get_protocol_module().define_options(parser)
+
+# Topology classes, indexed by the name of their module in
+# configs/topologies.
+_topology_classes = {}
+
+def _get_topology_class(name):
+    """Return the topology class defined by the topology module name."""
+
+    try:
+        return _topology_classes[name]
+    except KeyError:
+        cls = _topology_classes[name] = getattr(cached_import(name), name)
+        return cls
 
 def create_topology(controllers, options):
     """ Called from create_system in configs/ruby/<protocol>.py
@@ -185,70 +330,30 @@ def create_topology(controllers, options):
         found in configs/topologies/BaseTopology.py
         This is a wrapper for the legacy topologies.
     """
-    exec "import %s as Topo" % options.topology
-    topology = eval("Topo.%s(controllers)" % options.topology)
-    return topology
+    return _get_topology_class(options.topology)(controllers)
 
-def create_system(options, system, piobus = None, dma_ports = []):
-
-    system.ruby = RubySystem(no_mem_vec = options.use_map)
-    ruby = system.ruby
-
-    protocol = buildEnv['PROTOCOL']
-    exec "import %s" % protocol
-    try:
-        (cpu_sequencers, dir_cntrls, topology) = \
-             eval("%s.create_system(options, system, dma_ports, ruby)"
-                  % protocol)
-    except:
-        print "Error: could not create sytem for ruby protocol %s" % protocol
-        raise
+def _wire_directories(options, ruby, dir_cntrls):
+    """Override the memBuffer of each directory controller."""
 
-    # Override the memBuffer for each directory.
-    for i in xrange(options.num_dirs):
-        print "Changing memory type to %s" % options.ruby_mem_type
-        mem_cntrl_class = get_ruby_mem_class(options.ruby_mem_type)
+    print("Changing memory type to %s" % options.ruby_mem_type)
+    mem_cntrl_class = get_ruby_mem_class(options.ruby_mem_type)
+    ruby.no_mem_vec = False
+    for i in range(options.num_dirs):
         new_mem_cntrl = mem_cntrl_class(version = i, ruby_system = ruby)
-        ruby.no_mem_vec = False
-
-        exec("ruby.dir_cntrl%d.memBuffer = new_mem_cntrl" % i)
-
-    # Create a port proxy for connecting the system port. This is
-    # independent of the protocol and kept in the protocol-agnostic
-    # part (i.e. here).
-    sys_port_proxy = RubyPortProxy(ruby_system = ruby)
-    # Give the system port proxy a SimObject parent without creating a
-    # full-fledged controller
-    system.sys_port_proxy = sys_port_proxy
-
-    # Connect the system port for loading of binaries etc
-    system.system_port = system.sys_port_proxy.slave
+        dir_cntrls[i].memBuffer = new_mem_cntrl
 
+def _build_network(options, ruby, topology):
+    """Create the network selected on the command line for a topology."""
 
     #
     # Set the network classes based on the command line options
     #
-    if options.garnet_network == "fixed":
-        NetworkClass = GarnetNetwork_d
-        IntLinkClass = GarnetIntLink_d
-        ExtLinkClass = GarnetExtLink_d
-        RouterClass = GarnetRouter_d
-        InterfaceClass = GarnetNetworkInterface_d
-
-    elif options.garnet_network == "flexible":
-        NetworkClass = GarnetNetwork
-        IntLinkClass = GarnetIntLink
-        ExtLinkClass = GarnetExtLink
-        RouterClass = GarnetRouter
-        InterfaceClass = GarnetNetworkInterface
-
-    else:
-        NetworkClass = SimpleNetwork
-        IntLinkClass = SimpleIntLink
-        ExtLinkClass = SimpleExtLink
-        RouterClass = Switch
-        InterfaceClass = None
-
+    try:
+        (NetworkClass, IntLinkClass, ExtLinkClass, RouterClass,
+         InterfaceClass) = _network_classes[options.garnet_network]
+    except KeyError:
+        fatal("Network '%s' is not available in this build",
+              options.garnet_network)
 
     # Create the network topology
     network = NetworkClass(ruby_system = ruby, topology = topology.description,
@@ -257,7 +362,7 @@ def create_system(options, system, piobus = None, dma_ports = []):
             RouterClass)
 
     if InterfaceClass != None:
-        netifs = [InterfaceClass(id=i) for (i,n) in enumerate(network.ext_links)]
+        netifs = [InterfaceClass(id=i) for i in range(len(network.ext_links))]
         network.netifs = netifs
 
     if options.network_fault_model:
@@ -265,6 +370,59 @@ def create_system(options, system, piobus = None, dma_ports = []):
         network.enable_fault_model = True
         network.fault_model = FaultModel()
 
+    return network
+
+def _compute_numa_bit(options, block_size_bits):
+    """Return the high order address bit used for numa mapping."""
+
+    if options.numa_high_bit:
+        return options.numa_high_bit
+
+    # if the numa_bit is not specified, set the directory bits as the
+    # lowest bits above the block offset bits, and the numa_bit as the
+    # highest of those directory bits
+    dir_bits = options.num_dirs.bit_length() - 1
+    return block_size_bits + dir_bits - 1
+
+def _wire_sequencers(cpu_sequencers, piobus):
+    """Connect the cpu sequencers to the piobus."""
+
+    is_x86 = buildEnv['TARGET_ISA'] == "x86"
+    for cpu_seq in cpu_sequencers:
+        cpu_seq.pio_master_port = piobus.slave
+        cpu_seq.mem_master_port = piobus.slave
+
+        if is_x86:
+            cpu_seq.pio_slave_port = piobus.master
+
+def create_system(options, system, piobus = None, dma_ports = []):
+
+    system.ruby = RubySystem(no_mem_vec = options.use_map)
+    ruby = system.ruby
+
+    proto_mod = _get_protocol_module()
+    try:
+        (cpu_sequencers, dir_cntrls, topology) = \
+             proto_mod.create_system(options, system, dma_ports, ruby)
+    except Exception:
+        print("Error: could not create system for ruby protocol %s" % _protocol)
+        raise
+
+    _wire_directories(options, ruby, dir_cntrls)
+
+    # Create a port proxy for connecting the system port. This is
+    # independent of the protocol and kept in the protocol-agnostic
+    # part (i.e. here).
+    sys_port_proxy = RubyPortProxy(ruby_system = ruby)
+    # Give the system port proxy a SimObject parent without creating a
+    # full-fledged controller
+    system.sys_port_proxy = sys_port_proxy
+
+    # Connect the system port for loading of binaries etc
+    system.system_port = system.sys_port_proxy.slave
+
+    network = _build_network(options, ruby, topology)
+
     #
     # Loop through the directory controlers.
     # Determine the total memory size of the ruby system and verify it is equal
@@ -273,25 +431,18 @@ def create_system(options, system, piobus = None, dma_ports = []):
     # the Memory Vector and thus the memory size bytes should stay at 0.
     # Also set the numa bits to the appropriate values.
     #
-    total_mem_size = MemorySize('0B')
-
     ruby.block_size_bytes = options.cacheline_size
-    block_size_bits = int(math.log(options.cacheline_size, 2))
-
-    if options.numa_high_bit:
-        numa_bit = options.numa_high_bit
-    else:
-        # if the numa_bit is not specified, set the directory bits as the
-        # lowest bits above the block offset bits, and the numa_bit as the
-        # highest of those directory bits
-        dir_bits = int(math.log(options.num_dirs, 2))
-        numa_bit = block_size_bits + dir_bits - 1
+    block_size_bits = options.cacheline_size.bit_length() - 1
+    numa_bit = _compute_numa_bit(options, block_size_bits)
 
     for dir_cntrl in dir_cntrls:
-        total_mem_size.value += dir_cntrl.directory.size.value
         dir_cntrl.directory.numa_high_bit = numa_bit
 
-    phys_mem_size = sum(map(lambda r: r.size(), system.mem_ranges))
+    total_mem_size = MemorySize('0B')
+    total_mem_size.value = sum(dir_cntrl.directory.size.value
+                               for dir_cntrl in dir_cntrls)
+
+    phys_mem_size = sum(r.size() for r in system.mem_ranges)
     assert(total_mem_size.value == phys_mem_size)
 
     ruby.network = network
@@ -299,12 +450,7 @@ def create_system(options, system, piobus = None, dma_ports = []):
 
     # Connect the cpu sequencers and the piobus
     if piobus != None:
-        for cpu_seq in cpu_sequencers:
-            cpu_seq.pio_master_port = piobus.slave
-            cpu_seq.mem_master_port = piobus.slave
-
-            if buildEnv['TARGET_ISA'] == "x86":
-                cpu_seq.pio_slave_port = piobus.master
+        _wire_sequencers(cpu_sequencers, piobus)
 
     ruby._cpu_ports = cpu_sequencers
     ruby.num_of_sequencers = len(cpu_sequencers)